@@ -3,13 +3,27 @@
 """
 from typing import Annotated
 from fastapi import Depends
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import DeclarativeBase
 
+from app import query_log
+
 # Конфиг "движка" база данных
 engine = create_async_engine("sqlite+aiosqlite:///app/books.db")
 new_session = async_sessionmaker(engine, expire_on_commit=False)
 
+
+@event.listens_for(engine.sync_engine, "connect")
+def enable_foreign_keys(dbapi_connection, _connection_record):
+    """Включает проверку внешних ключей SQLite (нужно для ON DELETE CASCADE)."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+# Журнал медленных запросов (см. app/query_log.py)
+query_log.install(engine.sync_engine)
+
 async def get_session():
     """
     Сеанс работы с базой данных
@@ -1,10 +1,53 @@
 """
 Экземпляр FastApi
 """
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from app.routes import books, reviews, auth, adm
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import outbox, profiler, purge, query_log, recommendations, review_store, snapshot
+from app import suggest
+from app import outbox_handlers, versions  # pylint: disable=unused-import
+from app.database import new_session
+from app.routes import books, reviews, auth, adm, sync
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """Запуск и остановка фоновых задач приложения."""
+    await review_store.init_shards()
+    try:
+        await versions.init_versions()
+    except SQLAlchemyError as e:
+        print(f"[SYNC] Счетчик версий не восстановлен: {str(e)}")
+    # После счетчика версий: перенесенные отзывы получают новые версии
+    await review_store.move_primary_reviews()
+    try:
+        await suggest.load_index()
+    except SQLAlchemyError as e:
+        print(f"[SUGGEST] Индекс подсказок не построен: {str(e)}")
+    tasks = [
+        asyncio.create_task(snapshot.run_snapshot_worker()),
+        asyncio.create_task(purge.run_purge_worker()),
+        asyncio.create_task(recommendations.run_recommendations_worker()),
+        asyncio.create_task(
+            outbox.run_outbox_dispatcher([new_session, *review_store.shard_sessions])
+        ),
+    ]
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+app = FastAPI(lifespan=lifespan)
+
+# Без PROFILER_TOKEN профилировщик не подключается и ничего не стоит
+if profiler.enabled():
+    app.add_middleware(profiler.ProfilerMiddleware)
 
-app = FastAPI()
+app.add_middleware(query_log.RouteMiddleware)
 
 
 @app.get(
@@ -23,3 +66,4 @@ app.include_router(adm.router)
 app.include_router(auth.router)
 app.include_router(books.router)
 app.include_router(reviews.router)
+app.include_router(sync.router)
@@ -1,8 +1,10 @@
 """
 Модели SQLAlchemy для базы данных
 """
+import time
+
 from pydantic import computed_field
-from sqlalchemy import String, ForeignKey, func, select
+from sqlalchemy import String, ForeignKey, Text, false, func, select
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.ext.hybrid import hybrid_property
 
@@ -16,10 +18,14 @@ class UserModel(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     username: Mapped[str] = mapped_column(String(50), unique=True, nullable=False)
     password: Mapped[str] = mapped_column(String(256), nullable=False)
+    # Помечен на удаление - отзывы удаляются в фоне (см. app/purge.py)
+    is_deleted: Mapped[bool] = mapped_column(default=False, server_default=false())
+    # Отзывы удаляет сама база (ON DELETE CASCADE), ORM их не загружает
     reviews: Mapped[list["ReviewModel"]] = relationship(
         "ReviewModel",
         back_populates="user",
-        cascade="all, delete"
+        cascade="all, delete",
+        passive_deletes=True
         )
 
     def __str__(self):
@@ -35,10 +41,16 @@ class BookModel(Base):
     title: Mapped[str] = mapped_column(String(100), nullable=False)
     author: Mapped[str] = mapped_column(String(50), nullable=False)
     genre: Mapped[str] = mapped_column(String(30), nullable=False)
+    # Версия изменения для синхронизации (см. app/versions.py)
+    version: Mapped[int] = mapped_column(default=0, server_default="0", index=True)
+    # Помечена на удаление - отзывы удаляются в фоне (см. app/purge.py)
+    is_deleted: Mapped[bool] = mapped_column(default=False, server_default=false())
+    # Отзывы удаляет сама база (ON DELETE CASCADE), ORM их не загружает
     reviews: Mapped[list["ReviewModel"]] = relationship(
         "ReviewModel",
         back_populates="book",
         cascade="all, delete-orphan",
+        passive_deletes=True,
         lazy="selectin"
     )
 
@@ -66,8 +78,14 @@ class ReviewModel(Base):
     id: Mapped[int] = mapped_column(primary_key=True)
     text: Mapped[str] = mapped_column(String(500))
     rating: Mapped[int] = mapped_column( nullable=False)
-    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
-    book_id: Mapped[int] = mapped_column(ForeignKey("books.id"))
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("users.id", ondelete="CASCADE"), index=True
+    )
+    book_id: Mapped[int] = mapped_column(
+        ForeignKey("books.id", ondelete="CASCADE"), index=True
+    )
+    # Версия изменения для синхронизации (см. app/versions.py)
+    version: Mapped[int] = mapped_column(default=0, server_default="0", index=True)
     user: Mapped["UserModel"] = relationship("UserModel", back_populates="reviews")
     book: Mapped["BookModel"] = relationship("BookModel", back_populates="reviews")
 
@@ -80,3 +98,47 @@ class ReviewModel(Base):
     def user_title(self) -> str:
         """Добавлено, чтобы в отзыве было видно логин пользователя"""
         return self.user.username if self.user else "Пользователь удален"
+
+class BookSimilarityModel(Base):
+    """Модель похожей книги ("Читатели также оценили")"""
+    __tablename__ = "book_similarities"
+
+    # pylint: disable=too-few-public-methods
+    book_id: Mapped[int] = mapped_column(
+        ForeignKey("books.id", ondelete="CASCADE"), primary_key=True
+    )
+    similar_book_id: Mapped[int] = mapped_column(
+        ForeignKey("books.id", ondelete="CASCADE"), primary_key=True
+    )
+    score: Mapped[float] = mapped_column(nullable=False)
+
+class OutboxModel(Base):
+    """Модель события outbox: работа, отложенная до после коммита"""
+    __tablename__ = "outbox"
+
+    # pylint: disable=too-few-public-methods
+    id: Mapped[int] = mapped_column(primary_key=True)
+    topic: Mapped[str] = mapped_column(String(50), nullable=False)
+    payload: Mapped[str] = mapped_column(Text, nullable=False)
+    attempts: Mapped[int] = mapped_column(default=0, server_default="0")
+    # Время (unix), раньше которого событие не обрабатывается - для повторов
+    available_at: Mapped[float] = mapped_column(default=time.time, index=True)
+    last_error: Mapped[str | None] = mapped_column(String(500))
+
+class TombstoneModel(Base):
+    """Модель записи об удалении книги, пользователя или отзыва (для синхронизации)"""
+    __tablename__ = "tombstones"
+
+    # pylint: disable=too-few-public-methods
+    id: Mapped[int] = mapped_column(primary_key=True)
+    entity: Mapped[str] = mapped_column(String(20), nullable=False)
+    entity_id: Mapped[int] = mapped_column(nullable=False)
+    version: Mapped[int] = mapped_column(default=0, server_default="0", index=True)
+
+class SettingModel(Base):
+    """Модель служебной настройки базы (ключ - значение)"""
+    __tablename__ = "settings"
+
+    # pylint: disable=too-few-public-methods
+    key: Mapped[str] = mapped_column(String(50), primary_key=True)
+    value: Mapped[str] = mapped_column(String(200), nullable=False)
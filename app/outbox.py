@@ -0,0 +1,122 @@
+"""
+Transactional outbox: отложенная работа после коммита.
+
+Обработчик запроса записывает событие в таблицу outbox в той же транзакции,
+что и само изменение данных, и отвечает сразу после коммита. Фоновый
+диспетчер забирает события порциями и вызывает обработчики из
+app/outbox_handlers.py; при ошибке событие повторяется позже. Необработанные
+события лежат в базе и переживают перезапуск. Обработчики должны быть
+идемпотентными: событие может быть обработано повторно.
+"""
+
+import asyncio
+import json
+import os
+import time
+
+from sqlalchemy import delete, event, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.models import OutboxModel
+
+# Сколько событий забираем за раз
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+# Как часто проверяем таблицу без явного сигнала (секунды)
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+# Первая пауза перед повтором, дальше удваивается
+OUTBOX_RETRY_SECONDS = float(os.getenv("OUTBOX_RETRY_SECONDS", "1"))
+# После стольких неудач событие остается в таблице для разбора
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+
+_handlers = {}
+_wake = asyncio.Event()
+
+
+def handler(topic: str):
+    """Декоратор: регистрирует обработчик событий темы topic."""
+    def register(func):
+        _handlers[topic] = func
+        return func
+    return register
+
+
+def emit(session, topic: str, **payload):
+    """Добавляет событие в текущую транзакцию сессии."""
+    session.add(OutboxModel(topic=topic, payload=json.dumps(payload)))
+    session.info["outbox_pending"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_after_commit(session):
+    """После коммита с событиями будим диспетчер."""
+    if session.info.pop("outbox_pending", False):
+        _wake.set()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_after_rollback(session, _previous_transaction):
+    session.info.pop("outbox_pending", None)
+
+
+async def _dispatch_batch(make_session) -> int:
+    """Обрабатывает одну порцию событий из базы. Возвращает размер порции."""
+    now = time.time()
+    # Чтение и запись результатов - отдельными транзакциями: обработчики
+    # сами пишут в базу, и открытая транзакция им бы мешала
+    async with make_session() as session:
+        result = await session.execute(
+            select(OutboxModel)
+            .where(OutboxModel.available_at <= now)
+            .where(OutboxModel.attempts < OUTBOX_MAX_ATTEMPTS)
+            .order_by(OutboxModel.id)
+            .limit(OUTBOX_BATCH_SIZE)
+        )
+        events = result.scalars().all()
+    if not events:
+        return 0
+
+    done, failed = [], []
+    for outbox_event in events:
+        try:
+            await _handlers[outbox_event.topic](**json.loads(outbox_event.payload))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # Любая ошибка обработчика - повод повторить событие позже
+            failed.append((outbox_event, repr(e)[:500]))
+        else:
+            done.append(outbox_event.id)
+
+    async with make_session() as session:
+        if done:
+            await session.execute(delete(OutboxModel).where(OutboxModel.id.in_(done)))
+        for outbox_event, error in failed:
+            attempts = outbox_event.attempts + 1
+            await session.execute(
+                update(OutboxModel)
+                .where(OutboxModel.id == outbox_event.id)
+                .values(
+                    attempts=attempts,
+                    available_at=now + OUTBOX_RETRY_SECONDS * 2 ** (attempts - 1),
+                    last_error=error,
+                )
+            )
+            print(f"[OUTBOX] {outbox_event.topic} #{outbox_event.id}, попытка {attempts}: {error}")
+        await session.commit()
+    return len(events)
+
+
+async def run_outbox_dispatcher(session_makers):
+    """Фоновая задача: разбирает outbox во всех переданных базах."""
+    _wake.set()
+    while True:
+        try:
+            await asyncio.wait_for(_wake.wait(), OUTBOX_POLL_SECONDS)
+        except TimeoutError:
+            pass
+        _wake.clear()
+        for make_session in session_makers:
+            try:
+                while await _dispatch_batch(make_session) == OUTBOX_BATCH_SIZE:
+                    pass
+            except SQLAlchemyError as e:
+                print(f"[OUTBOX] Ошибка разбора событий: {str(e)}")
@@ -0,0 +1,76 @@
+"""
+Обработчики событий outbox.
+
+Каждый обработчик перечитывает актуальное состояние из базы, а не применяет
+приращения, поэтому повторная обработка события ничего не портит.
+"""
+
+from sqlalchemy import select
+from sqlalchemy.orm import noload
+
+from app import outbox, purge, recommendations, review_store, snapshot, suggest
+from app.database import new_session
+from app.models import BookModel, ReviewModel, UserModel
+
+
+@outbox.handler("book.changed")
+async def sync_book(book_id: int):
+    """Книга добавлена, изменена или удалена."""
+    # Читаем под блокировкой индекса: пересборка не обгонит это изменение
+    async with suggest.updating() as index:
+        async with new_session() as session:
+            result = await session.execute(
+                select(BookModel)
+                .where(BookModel.id == book_id)
+                .options(noload(BookModel.reviews))
+            )
+            book = result.scalar()
+        if book is None or book.is_deleted:
+            index.remove(book_id)
+        else:
+            stats = await review_store.rating_stats([book_id])
+            index.upsert(book.id, book.title, book.author)
+            index.set_rating(book.id, *stats.get(book.id, (0, 0)))
+    if book is None or book.is_deleted:
+        recommendations.forget_book(book_id)
+    if book is None:
+        # Внешние ключи не работают между файлами - отзывы в шардах удаляем сами
+        await review_store.delete_reviews(ReviewModel.book_id, book_id)
+    elif book.is_deleted:
+        purge.schedule_purge()
+    snapshot.mark_dirty()
+    recommendations.mark_dirty()
+
+
+@outbox.handler("review.added")
+async def sync_book_rating(book_id: int):
+    """Новый отзыв изменил рейтинг книги."""
+    async with suggest.updating() as index:
+        stats = await review_store.rating_stats([book_id])
+        index.set_rating(book_id, *stats.get(book_id, (0, 0)))
+    snapshot.mark_dirty()
+    recommendations.mark_dirty()
+
+
+@outbox.handler("user.deleted")
+async def sync_deleted_user(user_id: int, book_ids: list[int] | None = None):
+    """Пользователь удален (или помечен на удаление).
+
+    book_ids - книги с отзывами пользователя, если база удалила отзывы
+    вместе с ним и узнать их уже нельзя.
+    """
+    async with new_session() as session:
+        result = await session.execute(
+            select(UserModel.is_deleted).where(UserModel.id == user_id)
+        )
+        is_deleted = result.scalar()
+    if book_ids is None:
+        book_ids = await review_store.reviewed_books(user_id)
+    if is_deleted is None:
+        await review_store.delete_reviews(ReviewModel.user_id, user_id)
+    elif is_deleted:
+        purge.schedule_purge()
+    # Отзывы пользователя больше не учитываются - меняются рейтинги только его книг
+    await suggest.refresh_ratings(book_ids)
+    snapshot.mark_dirty()
+    recommendations.mark_dirty()
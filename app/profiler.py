@@ -0,0 +1,293 @@
+"""
+Профилирование отдельных запросов (cProfile) на работающем сервере.
+
+Включается переменной окружения PROFILER_TOKEN: без нее middleware не
+подключается вовсе и запросы идут без дополнительных затрат. Запрос
+профилируется, если пришел с заголовком X-Profile-Token, или по выборке:
+каждый N-й запрос выбранного маршрута (настраивается через /profiler/sampling).
+Номер профиля возвращается в заголовке ответа X-Profile-Id.
+
+Последние профили хранятся в ограниченном буфере: сводка времени по частям
+(сериализация Pydantic, SQLAlchemy/aiosqlite, код обработчиков, ожидание I/O,
+остальное) и статистика для скачивания в формате pstats или свернутых стеков.
+
+cProfile считает время для всего потока, поэтому в профиль попадает и работа
+других запросов, выполнявшихся одновременно. Одновременно профилируется
+только один запрос, остальные в это время идут без профилирования.
+"""
+
+import cProfile
+import itertools
+import marshal
+import os
+import secrets
+import time
+from collections import Counter, deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from fastapi import Header, HTTPException
+
+from app.query_log import route_of
+
+# Токен администратора: без него профилировщик выключен
+PROFILER_TOKEN = os.getenv("PROFILER_TOKEN", "")
+# Сколько последних профилей храним
+PROFILER_BUFFER_SIZE = int(os.getenv("PROFILER_BUFFER_SIZE", "20"))
+# Доли времени меньше этой части общего времени не разносим выше по стеку
+COLLAPSED_MIN_SHARE = 0.0005
+
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_ROOT_DIR = os.path.dirname(_APP_DIR)
+_SCHEMAS_FILE = os.path.join(_APP_DIR, "schemas.py")
+_SERIALIZATION_MARKERS = ("pydantic", os.path.join("fastapi", "encoders.py"))
+_DATABASE_MARKERS = ("sqlalchemy", "aiosqlite", "sqlite3")
+_IO_WAIT_MARKERS = ("select.epoll", "select.kqueue", "select.select", "select.poll")
+
+
+@dataclass
+class ProfileRecord:
+    """Профиль одного запроса."""
+    id: int
+    route: str
+    status: int | None
+    duration_ms: float
+    breakdown_ms: dict[str, float]
+    profiled_at: str
+    stats: dict
+
+    def summary(self) -> dict:
+        """Сводка без статистики по функциям."""
+        return {
+            "id": self.id,
+            "route": self.route,
+            "status": self.status,
+            "duration_ms": self.duration_ms,
+            "breakdown_ms": self.breakdown_ms,
+            "profiled_at": self.profiled_at,
+        }
+
+
+@dataclass
+class SamplingRule:
+    """Выборка: профилируем каждый every-й запрос маршрута."""
+    every: int
+    seen: int = 0
+
+
+@dataclass
+class ProfilerState:
+    """Состояние профилировщика процесса."""
+    # Идет профилирование запроса (cProfile работает на весь поток)
+    busy: bool = False
+
+
+_records: deque[ProfileRecord] = deque(maxlen=PROFILER_BUFFER_SIZE)
+_sampling: dict[str, SamplingRule] = {}
+_ids = itertools.count(1)
+_state = ProfilerState()
+
+
+def enabled() -> bool:
+    """Включен ли профилировщик (задан PROFILER_TOKEN)."""
+    return bool(PROFILER_TOKEN)
+
+
+def check_token(token: str) -> bool:
+    """Сравнивает токен с PROFILER_TOKEN за постоянное время."""
+    return enabled() and secrets.compare_digest(token.encode(), PROFILER_TOKEN.encode())
+
+
+def require_token(x_profile_token: str | None = Header(None)):
+    """Зависимость для эндпоинтов профилировщика: нужен верный токен."""
+    if not enabled():
+        raise HTTPException(404, "Профилировщик выключен: не задан PROFILER_TOKEN")
+    if x_profile_token is None or not check_token(x_profile_token):
+        raise HTTPException(403, "Неверный токен профилировщика")
+
+
+def set_sampling(route: str, every: int):
+    """Профилировать каждый every-й запрос маршрута ("GET /books"); 0 - выключить."""
+    if every:
+        _sampling[route] = SamplingRule(every)
+    else:
+        _sampling.pop(route, None)
+
+
+def sampling() -> dict[str, int]:
+    """Текущие правила выборки: {маршрут: N}."""
+    return {route: rule.every for route, rule in _sampling.items()}
+
+
+def profiles() -> list[dict]:
+    """Сводки сохраненных профилей, начиная с самых свежих."""
+    return [record.summary() for record in reversed(_records)]
+
+
+def get_profile(profile_id: int) -> ProfileRecord | None:
+    """Профиль по номеру (None, если уже вытеснен из буфера)."""
+    return next((record for record in _records if record.id == profile_id), None)
+
+
+def clear():
+    """Очищает буфер профилей."""
+    _records.clear()
+
+
+def _category(func: tuple) -> str:
+    """Часть приложения, к которой относится функция из статистики cProfile."""
+    filename, _, name = func
+    if filename == "~":
+        # Встроенные функции: файла нет, смотрим на имя
+        filename = name
+    if filename == _SCHEMAS_FILE or any(marker in filename for marker in _SERIALIZATION_MARKERS):
+        return "serialization"
+    if any(marker in filename for marker in _DATABASE_MARKERS):
+        return "database"
+    if any(marker in filename for marker in _IO_WAIT_MARKERS):
+        return "io_wait"
+    if filename.startswith(_APP_DIR) and not filename.endswith("profiler.py"):
+        return "handlers"
+    return "other"
+
+
+def breakdown(stats: dict) -> dict[str, float]:
+    """Собственное время функций (мс), сложенное по частям приложения."""
+    totals = dict.fromkeys(("serialization", "database", "handlers", "io_wait", "other"), 0.0)
+    for func, (_, _, tottime, _, _) in stats.items():
+        totals[_category(func)] += tottime
+    return {category: round(seconds * 1000, 3) for category, seconds in totals.items()}
+
+
+def _label(func: tuple) -> str:
+    filename, lineno, name = func
+    if filename == "~":
+        return name.replace(";", ",")
+    if filename.startswith(_ROOT_DIR):
+        filename = os.path.relpath(filename, _ROOT_DIR)
+    else:
+        filename = filename.rsplit("site-packages" + os.sep, 1)[-1]
+    return f"{filename}:{lineno}({name})".replace(";", ",")
+
+
+def collapsed_stacks(stats: dict) -> str:
+    """Свернутые стеки ("a;b;c микросекунды") для flamegraph.pl и speedscope.
+
+    cProfile хранит только пары вызывающий-вызываемый, поэтому стеки
+    восстанавливаются приближенно: собственное время функции делится между
+    вызывающими пропорционально времени, проведенному в ней из каждого из них,
+    и так далее вверх по цепочке. Корней у графа может не быть (корутины
+    и greenlet SQLAlchemy переключают стек), поэтому идем от листьев вверх.
+    """
+    total = sum(tottime for _, _, tottime, _, _ in stats.values())
+    min_share = total * COLLAPSED_MIN_SHARE
+    lines: Counter[str] = Counter()
+
+    def walk_up(func: tuple, share: float, chain: list[str], on_chain: set):
+        chain.append(_label(func))
+        on_chain.add(func)
+        weights = [
+            (caller, cumtime)
+            for caller, (_, _, _, cumtime) in stats[func][4].items()
+            if caller not in on_chain and caller in stats
+        ]
+        weight_total = sum(weight for _, weight in weights)
+        rest = share
+        if weight_total > 0 and len(chain) < 200:
+            for caller, weight in weights:
+                part = share * weight / weight_total
+                if part >= min_share:
+                    walk_up(caller, part, chain, on_chain)
+                    rest -= part
+        if rest > 0:
+            # Время, которое не удалось (или не стоит) разнести выше
+            lines[";".join(reversed(chain))] += rest
+        on_chain.discard(func)
+        chain.pop()
+
+    for func, (_, _, tottime, _, _) in stats.items():
+        if tottime > 0:
+            walk_up(func, tottime, [], set())
+    return "".join(
+        f"{stack} {round(seconds * 1_000_000)}\n"
+        for stack, seconds in sorted(lines.items())
+        if seconds >= 0.0000005
+    )
+
+
+def pstats_dump(stats: dict) -> bytes:
+    """Статистика в формате файла pstats (как Profile.dump_stats)."""
+    return marshal.dumps(stats)
+
+
+def _should_profile(scope) -> bool:
+    if scope["path"].startswith("/profiler"):
+        return False
+    for name, value in scope["headers"]:
+        if name == b"x-profile-token":
+            return check_token(value.decode("latin-1"))
+    if not _sampling:
+        return False
+    rule = _sampling.get(route_of(scope))
+    if rule is None:
+        return False
+    rule.seen += 1
+    return rule.seen % rule.every == 0
+
+
+class ProfilerMiddleware:  # pylint: disable=too-few-public-methods
+    """ASGI middleware: запускает выбранные запросы под cProfile."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or _state.busy or not _should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+        await self._profile(scope, receive, send)
+
+    async def _profile(self, scope, receive, send):
+        profile_id = next(_ids)
+        status = None
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {
+                    **message,
+                    "headers": [
+                        *message.get("headers", []),
+                        (b"x-profile-id", str(profile_id).encode()),
+                    ],
+                }
+            await send(message)
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Поток уже профилируется чем-то другим
+            await self.app(scope, receive, send)
+            return
+        _state.busy = True
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profile.disable()
+            duration = time.perf_counter() - started
+            _state.busy = False
+            profile.create_stats()
+            _records.append(ProfileRecord(
+                id=profile_id,
+                route=route_of(scope) or f"{scope['method']} {scope['path']}",
+                status=status,
+                duration_ms=round(duration * 1000, 3),
+                breakdown_ms=breakdown(profile.stats),
+                profiled_at=datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                stats=profile.stats,
+            ))
+            print(f"[PROFILER] Профиль #{profile_id}: {scope['method']} {scope['path']}, "
+                  f"{duration * 1000:.1f} мс")
@@ -0,0 +1,98 @@
+"""
+Фоновое удаление книг и пользователей с большим количеством отзывов.
+
+Запрос на удаление только помечает запись (is_deleted), а отзывы удаляются
+небольшими порциями в отдельных транзакциях, чтобы не держать блокировку
+записи SQLite надолго. После отзывов удаляется и сама запись.
+"""
+
+import asyncio
+import os
+
+from sqlalchemy import delete, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import review_store, snapshot, suggest
+from app.database import new_session
+from app.models import BookModel, ReviewModel, UserModel
+
+# Сколько отзывов удаляем за одну транзакцию
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "500"))
+# Пауза между порциями, чтобы запросы пользователей успевали писать в базу
+PURGE_PAUSE_SECONDS = float(os.getenv("PURGE_PAUSE_SECONDS", "0.05"))
+
+_pending = asyncio.Event()
+
+
+def schedule_purge():
+    """Будит фоновую задачу удаления."""
+    _pending.set()
+
+
+async def _purge_reviews(make_session, owner_column, owner_id: int):
+    """Удаляет отзывы книги/пользователя в одной базе порциями по PURGE_BATCH_SIZE."""
+    while True:
+        async with make_session() as session:
+            batch = (
+                select(ReviewModel.id)
+                .where(owner_column == owner_id)
+                .limit(PURGE_BATCH_SIZE)
+            )
+            result = await session.execute(
+                delete(ReviewModel)
+                .where(ReviewModel.id.in_(batch))
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+        if result.rowcount < PURGE_BATCH_SIZE:
+            return
+        await asyncio.sleep(PURGE_PAUSE_SECONDS)
+
+
+async def _marked(model) -> list[int]:
+    """ID-номера записей модели, помеченных на удаление."""
+    async with new_session() as session:
+        result = await session.execute(select(model.id).where(model.is_deleted.is_(True)))
+        return list(result.scalars().all())
+
+
+async def _purge(model, owner_column, owner_id: int):
+    """Удаляет помеченную запись модели вместе с ее отзывами."""
+    for make_session in review_store.sessions_for(owner_column, owner_id):
+        await _purge_reviews(make_session, owner_column, owner_id)
+    async with new_session() as session:
+        await session.execute(
+            delete(model)
+            .where(model.id == owner_id)
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+    print(f"[PURGE] {model.__tablename__}: запись {owner_id} удалена")
+
+
+async def purge_deleted():
+    """Доводит до конца все отложенные удаления."""
+    book_ids = await _marked(BookModel)
+    for book_id in book_ids:
+        await _purge(BookModel, ReviewModel.book_id, book_id)
+    user_ids = await _marked(UserModel)
+    for user_id in user_ids:
+        reviewed = await review_store.reviewed_books(user_id)
+        await _purge(UserModel, ReviewModel.user_id, user_id)
+        # Удаление могло опередить обработчик user.deleted, и тот уже не найдет
+        # отзывов пользователя - обновляем рейтинги его книг здесь
+        await suggest.refresh_ratings(reviewed)
+    if book_ids or user_ids:
+        snapshot.mark_dirty()
+
+
+async def run_purge_worker():
+    """Фоновая задача: при старте доделывает прерванные удаления, затем ждет новых."""
+    _pending.set()
+    while True:
+        await _pending.wait()
+        _pending.clear()
+        try:
+            await purge_deleted()
+        except SQLAlchemyError as e:
+            print(f"[PURGE] Ошибка фонового удаления: {str(e)}")
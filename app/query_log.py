@@ -0,0 +1,201 @@
+"""
+Журнал медленных запросов к базе данных.
+
+Слушатели событий движка замеряют время каждого SQL-запроса. Запросы дольше
+порога попадают в ограниченный кольцевой буфер вместе с планом выполнения
+(EXPLAIN QUERY PLAN), который снимается один раз на каждую форму запроса.
+Журнал отдается по HTTP только с заголовком X-Slow-Query-Token, равным
+переменной окружения SLOW_QUERY_TOKEN: в нем тексты запросов и маршруты.
+"""
+
+import os
+import re
+import secrets
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+
+from fastapi import Header, HTTPException
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.routing import Match
+
+# Порог в миллисекундах, начиная с которого запрос считается медленным
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "100"))
+# Сколько последних медленных запросов храним
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "200"))
+# Токен администратора для просмотра журнала: без него эндпоинты закрыты
+SLOW_QUERY_TOKEN = os.getenv("SLOW_QUERY_TOKEN", "")
+# Сколько планов выполнения держим в кэше
+PLAN_CACHE_SIZE = 500
+
+# ASGI scope текущего HTTP-запроса (выставляет RouteMiddleware); шаблон маршрута
+# по нему ищется только для медленных запросов, а не на каждый HTTP-запрос
+current_scope: ContextVar[dict | None] = ContextVar("current_scope", default=None)
+
+_EXPLAINABLE = ("SELECT", "WITH", "UPDATE", "DELETE")
+_WHITESPACE = re.compile(r"\s+")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+
+
+@dataclass
+class SlowQuery:
+    """Запись о медленном запросе."""
+    sql: str
+    params: str
+    route: str | None
+    duration_ms: float
+    plan: list[str]
+    executed_at: str
+
+
+_records: deque[SlowQuery] = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+_plans: OrderedDict[str, list[str]] = OrderedDict()
+
+
+def require_token(x_slow_query_token: str | None = Header(None)):
+    """Зависимость для эндпоинтов журнала: нужен верный токен."""
+    if not SLOW_QUERY_TOKEN:
+        raise HTTPException(404, "Журнал недоступен: не задан SLOW_QUERY_TOKEN")
+    if x_slow_query_token is None or not secrets.compare_digest(
+        x_slow_query_token.encode(), SLOW_QUERY_TOKEN.encode()
+    ):
+        raise HTTPException(403, "Неверный токен журнала медленных запросов")
+
+
+def normalize_sql(statement: str) -> str:
+    """Форма запроса: без лишних пробелов, списки IN (?, ?, ...) свернуты."""
+    statement = _WHITESPACE.sub(" ", statement).strip()
+    return _PLACEHOLDER_LIST.sub("(?, ...)", statement)
+
+
+def params_shape(parameters, executemany: bool) -> str:
+    """Типы параметров запроса вместо самих значений."""
+    if executemany:
+        count = len(parameters)
+        first = parameters[0] if count else ()
+        return f"{count} x {params_shape(first, False)}"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in parameters.items()) + "}"
+    return "(" + ", ".join(type(value).__name__ for value in parameters or ()) + ")"
+
+
+def _explain(conn, statement: str, parameters, executemany: bool) -> list[str]:
+    """Снимает EXPLAIN QUERY PLAN в той же транзакции, что и сам запрос."""
+    if executemany:
+        parameters = parameters[0] if parameters else ()
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        rows = cursor.fetchall()
+    except conn.dialect.dbapi.Error as e:
+        # Курсор драйвера бросает исключения самого драйвера (sqlite3.Error),
+        # а не обертки SQLAlchemy. Сбой EXPLAIN не должен ронять уже
+        # выполненный запрос пользователя
+        return [f"EXPLAIN не удался: {str(e)}"]
+    finally:
+        cursor.close()
+    # Строки плана: (id, parent, notused, detail) - отступ по глубине дерева
+    depth = {0: 0}
+    plan = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, 0) + 1
+        plan.append("  " * (depth[node_id] - 1) + detail)
+    return plan
+
+
+def _plan_for(conn, shape: str, statement: str, parameters, executemany: bool) -> list[str]:
+    """План из кэша или новый, если такая форма запроса встретилась впервые."""
+    plan = _plans.get(shape)
+    if plan is None:
+        if not shape.upper().startswith(_EXPLAINABLE):
+            plan = []
+        else:
+            plan = _explain(conn, statement, parameters, executemany)
+        _plans[shape] = plan
+        if len(_plans) > PLAN_CACHE_SIZE:
+            _plans.popitem(last=False)
+    return plan
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments,unused-argument
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started_at = conn.info["query_started_at"].pop()
+    duration_ms = (time.perf_counter() - started_at) * 1000
+    if duration_ms < SLOW_QUERY_THRESHOLD_MS:
+        return
+    shape = normalize_sql(statement)
+    _records.append(SlowQuery(
+        sql=shape,
+        params=params_shape(parameters, executemany),
+        route=_current_route(),
+        duration_ms=round(duration_ms, 3),
+        plan=_plan_for(conn, shape, statement, parameters, executemany),
+        executed_at=datetime.now(timezone.utc).isoformat(),
+    ))
+
+
+def _handle_error(exception_context):
+    # Упавший запрос не дойдет до after_cursor_execute - убираем его отметку
+    started = exception_context.connection.info.get("query_started_at") \
+        if exception_context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def _current_route() -> str | None:
+    scope = current_scope.get()
+    if scope is None:
+        return None
+    # Шаблон маршрута, а не путь: /books/5 и /books/6 - один маршрут
+    return route_of(scope) or f"{scope['method']} {scope['path']}"
+
+
+def route_of(scope) -> str | None:
+    """Шаблон маршрута запроса в виде "GET /books/{book_id}"."""
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return f"{scope['method']} {route.path}"
+    return None
+
+
+def install(engine: Engine):
+    """Подключает журнал медленных запросов к синхронному движку."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def slow_queries() -> list[dict]:
+    """Медленные запросы, начиная с самых свежих."""
+    return [asdict(record) for record in reversed(_records)]
+
+
+def clear():
+    """Очищает журнал и кэш планов."""
+    _records.clear()
+    _plans.clear()
+
+
+class RouteMiddleware:  # pylint: disable=too-few-public-methods
+    """ASGI middleware: запоминает scope запроса для журнала медленных запросов."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = current_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_scope.reset(token)
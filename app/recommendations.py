@@ -0,0 +1,255 @@
+"""
+Рекомендации "Читатели также оценили".
+
+Фоновая задача строит разреженную матрицу оценок пользователь x книга (CSR
+на массивах numpy) и считает сходство книг по скорректированному косинусу:
+оценки центрируются по среднему пользователя. Память растет с числом оценок,
+а не с произведением пользователей на книги; плотный только текущий блок
+книга x книга. Каждая операция numpy ограничена по размеру, поэтому пересчет
+в потоке не останавливает цикл событий надолго. Для каждой книги сохраняются
+SIMILAR_TOP_K самых похожих книг - в таблицу book_similarities и в словарь
+в памяти, из которого отвечает эндпоинт.
+"""
+
+import asyncio
+import os
+from dataclasses import dataclass
+
+import numpy as np
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import aliased
+
+from app import review_store
+from app.database import new_session
+from app.models import BookModel, BookSimilarityModel, UserModel
+
+# Сколько похожих книг храним для каждой книги
+SIMILAR_TOP_K = 10
+# Сглаживание: сходство по малому числу общих читателей уменьшается
+SIMILARITY_SHRINKAGE = 5
+# Сколько ячеек (книга x книга) в плотном блоке произведений
+SIMILARITY_BLOCK_CELLS = 2_000_000
+# Сколько пар оценок разворачиваем за раз
+SIMILARITY_MAX_PAIRS = 2_000_000
+# Не чаще одного пересчета за этот интервал (секунды)
+RECOMMENDATIONS_INTERVAL_SECONDS = float(os.getenv("RECOMMENDATIONS_INTERVAL_SECONDS", "300"))
+
+
+@dataclass
+class SimilarBook:
+    """Похожая книга с оценкой сходства."""
+    id: int
+    title: str
+    author: str
+    score: float
+
+
+_similar: dict[int, list[SimilarBook]] = {}
+_dirty = asyncio.Event()
+
+
+def mark_dirty():
+    """Сообщает фоновой задаче, что оценки изменились."""
+    _dirty.set()
+
+
+def similar_books(book_id: int) -> list[SimilarBook]:
+    """Готовый список похожих книг (поиск в словаре)."""
+    return _similar.get(book_id, [])
+
+
+def forget_book(book_id: int):
+    """Убирает удаленную книгу из рекомендаций, не дожидаясь пересчета."""
+    _similar.pop(book_id, None)
+    for book, similar in _similar.items():
+        if any(item.id == book_id for item in similar):
+            _similar[book] = [item for item in similar if item.id != book_id]
+
+
+@dataclass
+class _UserRows:
+    """Разреженная матрица оценок по строкам пользователей (CSR)."""
+    user_idx: np.ndarray
+    book_idx: np.ndarray
+    centered: np.ndarray
+    start: np.ndarray
+    length: np.ndarray
+
+
+def _block_products(
+        block: slice,
+        entries: np.ndarray,
+        users: _UserRows,
+        n_books: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Скалярные произведения и число общих читателей для блока книг.
+
+    entries - оценки книг блока (индексы в отсортированных по пользователю
+    массивах). Каждая оценка дает пары со всеми оценками того же пользователя;
+    пары копятся в плотном блоке книга блока x все книги.
+    """
+    # pylint: disable=too-many-locals
+    size = (block.stop - block.start) * n_books
+    dots = np.zeros(size)
+    common = np.zeros(size)
+    lengths = users.length[users.user_idx[entries]]
+    # Пары разворачиваем порциями, чтобы временные массивы были ограничены
+    bounds = np.searchsorted(
+        np.cumsum(lengths), np.arange(SIMILARITY_MAX_PAIRS, lengths.sum(), SIMILARITY_MAX_PAIRS)
+    )
+    for part, part_lengths in zip(np.split(entries, bounds), np.split(lengths, bounds)):
+        if not part.size:
+            continue
+        source = np.repeat(np.arange(part.size), part_lengths)
+        offsets = np.arange(source.size) - np.repeat(np.cumsum(part_lengths) - part_lengths,
+                                                     part_lengths)
+        partner = users.start[users.user_idx[part]][source] + offsets
+        flat = (users.book_idx[part][source] - block.start) * n_books + users.book_idx[partner]
+        dots += np.bincount(
+            flat, weights=users.centered[part][source] * users.centered[partner], minlength=size
+        )
+        common += np.bincount(flat, minlength=size)
+    shape = (block.stop - block.start, n_books)
+    return dots.reshape(shape), common.reshape(shape)
+
+
+def compute_similarities(
+        ratings: list[tuple[int, int, int]],
+        top_k: int = SIMILAR_TOP_K
+) -> dict[int, list[tuple[int, float]]]:
+    """Считает top_k похожих книг для каждой книги по оценкам (user_id, book_id, rating)."""
+    # pylint: disable=too-many-locals
+    if not ratings:
+        return {}
+    data = np.asarray(ratings, dtype=np.int64)
+    # Повторные оценки одной книги одним пользователем усредняем
+    # (одним ключом user_id << 32 | book_id: unique по строкам в разы медленнее).
+    # Ключи отсортированы, поэтому оценки идут по пользователям - это строки CSR
+    pairs, pair_idx = np.unique((data[:, 0] << 32) | data[:, 1], return_inverse=True)
+    values = np.bincount(pair_idx, weights=data[:, 2]) / np.bincount(pair_idx)
+    _, user_idx = np.unique(pairs >> 32, return_inverse=True)
+    book_ids, book_idx = np.unique(pairs & 0xFFFFFFFF, return_inverse=True)
+    n_books = len(book_ids)
+
+    # Оценки минус среднее пользователя; у пользователя с одной оценкой
+    # вычитаем общее среднее
+    per_user = np.bincount(user_idx)
+    user_mean = np.bincount(user_idx, weights=values) / per_user
+    user_mean[per_user == 1] = values.mean()
+    centered = values - user_mean[user_idx]
+    norms = np.sqrt(np.bincount(book_idx, weights=centered * centered, minlength=n_books))
+    users = _UserRows(
+        user_idx=user_idx,
+        book_idx=book_idx,
+        centered=centered,
+        start=np.cumsum(per_user) - per_user,
+        length=per_user,
+    )
+
+    # Оценки по книгам (столбцы); общие читатели бывают только у тех,
+    # кто оценил хотя бы две книги
+    by_book = np.argsort(book_idx, kind="stable")
+    by_book = by_book[per_user[user_idx[by_book]] > 1]
+    book_bounds = np.searchsorted(book_idx[by_book], np.arange(n_books + 1))
+
+    result = {}
+    # Плотен только блок книга x книга: размер блока ограничен SIMILARITY_BLOCK_CELLS
+    block_size = max(1, SIMILARITY_BLOCK_CELLS // n_books)
+    for start in range(0, n_books, block_size):
+        block = slice(start, min(start + block_size, n_books))
+        entries = by_book[book_bounds[block.start]:book_bounds[block.stop]]
+        dots, common = _block_products(block, entries, users, n_books)
+        denominator = np.outer(norms[block], norms)
+        valid = (dots > 0) & (denominator > 0)
+        valid[np.arange(dots.shape[0]), np.arange(block.start, block.stop)] = False
+        scores = np.divide(dots, denominator, out=np.zeros_like(dots), where=valid)
+        scores *= common / (common + SIMILARITY_SHRINKAGE)
+        scores = scores.round(6)
+        for row in range(dots.shape[0]):
+            candidates = np.flatnonzero(valid[row])
+            if not candidates.size:
+                continue
+            # По убыванию сходства, при равенстве - по убыванию ID-номера
+            order = np.lexsort((-candidates, -scores[row, candidates]))[:top_k]
+            result[int(book_ids[block.start + row])] = [
+                (int(book_ids[col]), float(scores[row, col]))
+                for col in candidates[order]
+            ]
+    return result
+
+
+async def _load_ratings() -> list[tuple[int, int, int]]:
+    """Оценки без учета удаляемых книг и пользователей."""
+    async with new_session() as session:
+        book_ids = set((await session.execute(
+            select(BookModel.id).where(BookModel.is_deleted.is_(False))
+        )).scalars())
+        user_ids = set((await session.execute(
+            select(UserModel.id).where(UserModel.is_deleted.is_(False))
+        )).scalars())
+    return [
+        (user_id, book_id, rating)
+        for user_id, book_id, rating in await review_store.all_ratings()
+        if book_id in book_ids and user_id in user_ids
+    ]
+
+
+async def load_similar_books():
+    """Загружает сохраненные рекомендации из базы в память."""
+    global _similar  # pylint: disable=global-statement
+    similar_book = aliased(BookModel)
+    async with new_session() as session:
+        result = await session.execute(
+            select(
+                BookSimilarityModel.book_id,
+                similar_book.id,
+                similar_book.title,
+                similar_book.author,
+                BookSimilarityModel.score,
+            )
+            .join(similar_book, similar_book.id == BookSimilarityModel.similar_book_id)
+            .where(similar_book.is_deleted.is_(False))
+            .order_by(BookSimilarityModel.book_id, BookSimilarityModel.score.desc())
+        )
+    similar: dict[int, list[SimilarBook]] = {}
+    for book_id, *similar_fields in result.all():
+        similar.setdefault(book_id, []).append(SimilarBook(*similar_fields))
+    _similar = similar
+
+
+async def rebuild_similarities():
+    """Пересчитывает рекомендации, сохраняет их в базу и обновляет словарь."""
+    ratings = await _load_ratings()
+    similarities = await asyncio.to_thread(compute_similarities, ratings)
+    rows = [
+        {"book_id": book_id, "similar_book_id": similar_id, "score": score}
+        for book_id, neighbours in similarities.items()
+        for similar_id, score in neighbours
+    ]
+    async with new_session() as session:
+        await session.execute(delete(BookSimilarityModel))
+        if rows:
+            await session.execute(insert(BookSimilarityModel), rows)
+        await session.commit()
+    await load_similar_books()
+    print(f"[RECOMMENDATIONS] Пересчитано: книг {len(similarities)}, оценок {len(ratings)}")
+
+
+async def run_recommendations_worker():
+    """Фоновая задача: пересчет после изменений, не чаще раза за интервал."""
+    try:
+        await load_similar_books()
+    except SQLAlchemyError as e:
+        print(f"[RECOMMENDATIONS] Сохраненные рекомендации не загружены: {str(e)}")
+    _dirty.set()
+    while True:
+        await _dirty.wait()
+        _dirty.clear()
+        try:
+            await rebuild_similarities()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # Любая ошибка (база, нехватка памяти, numpy) не должна
+            # останавливать задачу: следующий пересчет попробует снова
+            print(f"[RECOMMENDATIONS] Ошибка пересчета: {e!r}")
+        await asyncio.sleep(RECOMMENDATIONS_INTERVAL_SECONDS)
@@ -0,0 +1,352 @@
+"""
+Хранилище отзывов: основная база или несколько файлов-шардов.
+
+При REVIEW_SHARDS = 0 отзывы лежат в основной базе app/books.db, как раньше.
+При REVIEW_SHARDS = N отзывы распределяются по N файлам SQLite по хэшу book_id.
+У каждого файла свой движок и своя блокировка записи, поэтому запись отзывов
+масштабируется с числом шардов. Книги и пользователи остаются в основной базе.
+
+Операции над одной книгой идут в один шард, списки и агрегаты опрашивают
+все шарды параллельно (asyncio.gather) и объединяют результат.
+Число шардов нельзя менять без переноса данных: от него зависят адреса отзывов,
+поэтому оно запоминается в основной базе и проверяется при запуске.
+"""
+
+import asyncio
+import os
+import zlib
+
+from sqlalchemy import Column, MetaData, Table, delete, func, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import selectinload
+
+from app import outbox, query_log
+from app.database import engine as primary_engine, new_session
+from app.models import (
+    BookModel, OutboxModel, ReviewModel, SettingModel, TombstoneModel, UserModel
+)
+from app.schemas import ReviewSchema, ReviewSyncSchema
+
+REVIEW_SHARDS = int(os.getenv("REVIEW_SHARDS", "0"))
+REVIEW_SHARD_URL = os.getenv("REVIEW_SHARD_URL", "sqlite+aiosqlite:///app/reviews_{}.db")
+# Ключ настройки в основной базе: на сколько шардов разбиты отзывы
+SHARDS_SETTING = "review_shards"
+
+# Таблицы в шарде: те же колонки, но без внешних ключей -
+# книги и пользователи хранятся в другом файле
+shard_metadata = MetaData()
+for model in (ReviewModel, OutboxModel):
+    Table(
+        model.__tablename__,
+        shard_metadata,
+        *(
+            Column(
+                column.name,
+                column.type,
+                primary_key=column.primary_key,
+                nullable=column.nullable,
+                index=column.index,
+            )
+            for column in model.__table__.columns
+        ),
+    )
+
+shard_engines = [
+    create_async_engine(REVIEW_SHARD_URL.format(shard)) for shard in range(REVIEW_SHARDS)
+]
+shard_sessions = [
+    async_sessionmaker(engine, expire_on_commit=False) for engine in shard_engines
+]
+for engine in shard_engines:
+    query_log.install(engine.sync_engine)
+
+
+def sharded() -> bool:
+    """Включено ли хранение отзывов в шардах."""
+    return REVIEW_SHARDS > 0
+
+
+def shard_of(book_id: int) -> int:
+    """Номер шарда, в котором лежат отзывы книги."""
+    return zlib.crc32(str(book_id).encode()) % REVIEW_SHARDS
+
+
+def global_review_id(local_id: int, shard: int) -> int:
+    """Сквозной ID-номер отзыва: локальный ID в шарде плюс номер шарда."""
+    return local_id * REVIEW_SHARDS + shard
+
+
+def sessions_for(owner_column, owner_id: int) -> list[async_sessionmaker]:
+    """Базы, в которых могут лежать отзывы книги или пользователя."""
+    if not sharded():
+        return [new_session]
+    if owner_column.key == "book_id":
+        return [shard_sessions[shard_of(owner_id)]]
+    return shard_sessions
+
+
+async def init_shards(drop: bool = False):
+    """Создает таблицу отзывов в каждом шарде (drop=True - пересоздает).
+
+    Число шардов запоминается в основной базе (настройка review_shards).
+    Если база уже разбита на другое число шардов (или шарды выключены после
+    разбиения), запуск прерывается: отзывы оказались бы не в тех файлах.
+    При drop=True запомненное число заменяется текущим.
+    """
+    async with primary_engine.begin() as connection:
+        await connection.run_sync(SettingModel.__table__.create, checkfirst=True)
+    async with new_session() as session:
+        setting = await session.get(SettingModel, SHARDS_SETTING)
+        stored = None if setting is None else int(setting.value)
+        if stored is not None and stored != REVIEW_SHARDS and not drop:
+            raise RuntimeError(
+                f"Отзывы в базе разбиты на {stored} шард(ов), а REVIEW_SHARDS={REVIEW_SHARDS}: "
+                "верните прежнее значение или перенесите отзывы вручную"
+            )
+        if drop and setting is not None:
+            await session.delete(setting)
+        if sharded() and (stored is None or drop):
+            # Без шардов число не запоминаем: включить шарды позже можно,
+            # отзывы из основной базы перенесет move_primary_reviews
+            session.add(SettingModel(key=SHARDS_SETTING, value=str(REVIEW_SHARDS)))
+        await session.commit()
+    for shard_engine in shard_engines:
+        async with shard_engine.begin() as connection:
+            if drop:
+                await connection.run_sync(shard_metadata.drop_all)
+            await connection.run_sync(shard_metadata.create_all)
+
+
+async def move_primary_reviews():
+    """Переносит отзывы из основной базы в пустые шарды.
+
+    В шардах у отзывов новые ID-номера и новые версии, а для старых
+    ID-номеров пишутся записи об удалении (entity="review"): клиенты
+    синхронизации удалят старые копии и получат отзывы под новыми номерами.
+    Записи об удалении получают версии раньше перенесенных отзывов.
+    Если в шардах уже есть отзывы, а в основной базе тоже, запуск прерывается:
+    иначе часть отзывов пропала бы из выдачи, а какие из них актуальны - неизвестно.
+    """
+    if not sharded():
+        return
+    columns = ("id", "text", "rating", "user_id", "book_id")
+    async with new_session() as session:
+        result = await session.execute(
+            select(*(getattr(ReviewModel, name) for name in columns)).order_by(ReviewModel.id)
+        )
+        rows = [row._asdict() for row in result.all()]
+        if not rows:
+            return
+        counts = await _fan_out(select(func.count(ReviewModel.id)))  # pylint: disable=not-callable
+        if any(shard_rows[0][0] for _, shard_rows in counts):
+            raise RuntimeError(
+                f"Отзывы есть и в основной базе ({len(rows)} шт.), и в шардах: "
+                "перенесите их вручную или выключите REVIEW_SHARDS"
+            )
+
+        # Удаление и записи об удалении - одной транзакцией после записи в шарды;
+        # flush сразу, чтобы версии удалений были меньше версий новых отзывов
+        session.add_all(TombstoneModel(entity="review", entity_id=row["id"]) for row in rows)
+        await session.execute(delete(ReviewModel))
+        await session.flush()
+
+        by_shard: dict[int, list[dict]] = {}
+        for row in rows:
+            by_shard.setdefault(shard_of(row["book_id"]), []).append(row)
+        for shard, shard_rows in by_shard.items():
+            async with shard_sessions[shard]() as shard_session:
+                shard_session.add_all(
+                    ReviewModel(**{name: row[name] for name in columns if name != "id"})
+                    for row in shard_rows
+                )
+                await shard_session.commit()
+        await session.commit()
+    print(f"[SHARDS] Отзывы из основной базы перенесены в шарды: {len(rows)}")
+
+
+async def _fan_out(statement, make_sessions=None) -> list[tuple[int, list]]:
+    """Выполняет запрос во всех (или указанных) шардах параллельно."""
+    async def run(shard: int, make_session):
+        async with make_session() as session:
+            result = await session.execute(statement)
+            return shard, result.all()
+    targets = make_sessions or dict(enumerate(shard_sessions))
+    return await asyncio.gather(*(run(shard, make) for shard, make in targets.items()))
+
+
+async def add_review(session, review: ReviewModel):
+    """Сохраняет отзыв: в основную базу (в сессии запроса) или в шард книги.
+
+    Событие outbox пишется в ту же базу и транзакцию, что и отзыв.
+    """
+    if not sharded():
+        session.add(review)
+        outbox.emit(session, "review.added", book_id=review.book_id)
+        await session.commit()
+        return
+    async with shard_sessions[shard_of(review.book_id)]() as shard_session:
+        shard_session.add(review)
+        outbox.emit(shard_session, "review.added", book_id=review.book_id)
+        await shard_session.commit()
+
+
+async def list_reviews(session) -> list:
+    """Все отзывы, кроме отзывов удаляемых книг и пользователей."""
+    if not sharded():
+        result = await session.execute(
+            select(ReviewModel)
+            # Отзывы удаляемых в фоне книг и пользователей не показываем
+            .where(~ReviewModel.book.has(BookModel.is_deleted.is_(True)))
+            .where(~ReviewModel.user.has(UserModel.is_deleted.is_(True)))
+            .options(
+                selectinload(ReviewModel.book),
+                selectinload(ReviewModel.user))
+            )
+        return result.scalars().all()
+
+    shard_rows = await _fan_out(
+        select(
+            ReviewModel.id,
+            ReviewModel.text,
+            ReviewModel.rating,
+            ReviewModel.user_id,
+            ReviewModel.book_id,
+        )
+    )
+    titles = dict((await session.execute(
+        select(BookModel.id, BookModel.title).where(BookModel.is_deleted.is_(False))
+    )).all())
+    usernames = dict((await session.execute(
+        select(UserModel.id, UserModel.username).where(UserModel.is_deleted.is_(False))
+    )).all())
+    reviews = [
+        ReviewSchema(
+            id=global_review_id(row.id, shard),
+            text=row.text,
+            rating=row.rating,
+            user_id=row.user_id,
+            book_id=row.book_id,
+            book_title=titles[row.book_id],
+            user_title=usernames[row.user_id],
+        )
+        for shard, rows in shard_rows
+        for row in rows
+        if row.book_id in titles and row.user_id in usernames
+    ]
+    reviews.sort(key=lambda review: review.id)
+    return reviews
+
+
+async def rating_stats(book_ids: list[int] | None = None) -> dict[int, tuple[int, int]]:
+    """Количество отзывов и сумма оценок по книгам: {book_id: (count, sum)}.
+
+    Отзывы пользователей, удаляемых в фоне, не учитываются.
+    """
+    statement = (
+        select(
+            ReviewModel.book_id,
+            func.count(ReviewModel.id),  # pylint: disable=not-callable
+            func.sum(ReviewModel.rating),
+        )
+        .group_by(ReviewModel.book_id)
+    )
+    if book_ids is not None:
+        statement = statement.where(ReviewModel.book_id.in_(book_ids))
+    deleted_users = select(UserModel.id).where(UserModel.is_deleted.is_(True))
+    if not sharded():
+        statement = statement.where(ReviewModel.user_id.not_in(deleted_users))
+        async with new_session() as session:
+            rows = (await session.execute(statement)).all()
+    else:
+        # Пользователи в другой базе - подставляем их список в запрос к шардам
+        async with new_session() as session:
+            deleted_ids = (await session.execute(deleted_users)).scalars().all()
+        if deleted_ids:
+            statement = statement.where(ReviewModel.user_id.not_in(deleted_ids))
+        targets = None
+        if book_ids is not None:
+            targets = {shard_of(book_id): shard_sessions[shard_of(book_id)] for book_id in book_ids}
+        rows = [row for _, shard_rows in await _fan_out(statement, targets) for row in shard_rows]
+    return {book_id: (count, total) for book_id, count, total in rows}
+
+
+async def reviewed_books(user_id: int) -> list[int]:
+    """Книги, на которые пользователь оставлял отзывы."""
+    statement = select(ReviewModel.book_id).where(ReviewModel.user_id == user_id).distinct()
+    if not sharded():
+        async with new_session() as session:
+            return list((await session.execute(statement)).scalars().all())
+    return [row[0] for _, rows in await _fan_out(statement) for row in rows]
+
+
+async def all_ratings() -> list[tuple[int, int, int]]:
+    """Все оценки в виде (user_id, book_id, rating)."""
+    statement = select(ReviewModel.user_id, ReviewModel.book_id, ReviewModel.rating)
+    if not sharded():
+        async with new_session() as session:
+            return [tuple(row) for row in (await session.execute(statement)).all()]
+    return [tuple(row) for _, rows in await _fan_out(statement) for row in rows]
+
+
+async def changed_reviews(since: int, until: int, limit: int) -> list[ReviewSyncSchema]:
+    """Отзывы с версией в (since, until], не больше limit, по возрастанию версии."""
+    statement = (
+        select(
+            ReviewModel.id,
+            ReviewModel.text,
+            ReviewModel.rating,
+            ReviewModel.user_id,
+            ReviewModel.book_id,
+            ReviewModel.version,
+        )
+        .where(ReviewModel.version > since)
+        .where(ReviewModel.version <= until)
+        .order_by(ReviewModel.version)
+        .limit(limit)
+    )
+    if not sharded():
+        async with new_session() as session:
+            shard_rows = [(None, (await session.execute(statement)).all())]
+    else:
+        shard_rows = await _fan_out(statement)
+    reviews = [
+        ReviewSyncSchema(
+            id=row.id if shard is None else global_review_id(row.id, shard),
+            text=row.text,
+            rating=row.rating,
+            user_id=row.user_id,
+            book_id=row.book_id,
+            version=row.version,
+        )
+        for shard, rows in shard_rows
+        for row in rows
+    ]
+    reviews.sort(key=lambda review: review.version)
+    return reviews[:limit]
+
+
+async def max_version() -> int:
+    """Максимальная версия отзыва в шардах (0, если шарды выключены)."""
+    if not sharded():
+        return 0
+    statement = select(func.max(ReviewModel.version))
+    return max((rows[0][0] or 0 for _, rows in await _fan_out(statement)), default=0)
+
+
+async def delete_reviews(owner_column, owner_id: int):
+    """Удаляет отзывы книги/пользователя из шардов.
+
+    В основной базе отзывы удаляет сама база (ON DELETE CASCADE).
+    """
+    if not sharded():
+        return
+
+    async def run(make_session):
+        async with make_session() as session:
+            await session.execute(
+                delete(ReviewModel)
+                .where(owner_column == owner_id)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+    await asyncio.gather(*(run(make) for make in sessions_for(owner_column, owner_id)))
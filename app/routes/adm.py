@@ -2,7 +2,10 @@
 Модуль управления базой данных. Эндпоинт для пересоздания базы данных.
 """
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import PlainTextResponse
+
+from app import profiler, query_log, recommendations, review_store, snapshot, suggest
 from app.database import engine, Base
 
 router = APIRouter(tags=["Database"])
@@ -21,4 +24,104 @@ async def setup_database():
     async with engine.begin() as connection:
         await connection.run_sync(Base.metadata.drop_all)
         await connection.run_sync(Base.metadata.create_all)
+    await review_store.init_shards(drop=True)
+    snapshot.mark_dirty()
+    await suggest.load_index()
+    await recommendations.load_similar_books()
     return {"message": "База данных успешно создана!!!"}
+
+###############################
+#Журнал медленных запросов
+###############################
+@router.get(
+    "/slow-queries",
+    summary="Журнал медленных запросов",
+    description="Последние запросы к базе, выполнявшиеся дольше порога "
+                "SLOW_QUERY_THRESHOLD_MS, с планом выполнения (EXPLAIN QUERY PLAN). "
+                "Нужен заголовок X-Slow-Query-Token.",
+    dependencies=[Depends(query_log.require_token)],
+    )
+async def get_slow_queries():
+    """Возвращает медленные запросы, начиная с самых свежих."""
+    return {
+        "threshold_ms": query_log.SLOW_QUERY_THRESHOLD_MS,
+        "queries": query_log.slow_queries(),
+    }
+
+@router.delete(
+    "/slow-queries",
+    summary="Очистка журнала медленных запросов",
+    dependencies=[Depends(query_log.require_token)],
+    )
+async def clear_slow_queries():
+    """Очищает журнал медленных запросов и кэш планов."""
+    query_log.clear()
+    return {"message": "Журнал медленных запросов очищен"}
+
+###############################
+#Профилирование запросов (cProfile)
+###############################
+@router.get(
+    "/profiler/profiles",
+    summary="Сохраненные профили запросов",
+    description="Последние профили запросов: время по частям приложения - "
+                "сериализация Pydantic, SQLAlchemy/aiosqlite, обработчики, ожидание I/O. "
+                "Нужен заголовок X-Profile-Token; тот же заголовок на любом запросе "
+                "запускает его профилирование.",
+    dependencies=[Depends(profiler.require_token)],
+    )
+async def get_profiles():
+    """Возвращает сводки профилей, начиная с самых свежих."""
+    return {"profiles": profiler.profiles(), "sampling": profiler.sampling()}
+
+@router.get(
+    "/profiler/profiles/{profile_id}",
+    summary="Скачать профиль запроса",
+    description="format=pstats - файл для pstats/snakeviz, "
+                "format=collapsed - свернутые стеки для flamegraph.pl/speedscope.",
+    dependencies=[Depends(profiler.require_token)],
+    )
+async def download_profile(
+    profile_id: int,
+    profile_format: str = Query("pstats", alias="format", pattern="^(pstats|collapsed)$"),
+):
+    """Отдает профиль в выбранном формате."""
+    record = profiler.get_profile(profile_id)
+    if record is None:
+        raise HTTPException(404, "Профиль не найден")
+    if profile_format == "collapsed":
+        return PlainTextResponse(profiler.collapsed_stacks(record.stats))
+    return Response(
+        profiler.pstats_dump(record.stats),
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.pstats"'},
+    )
+
+@router.put(
+    "/profiler/sampling",
+    summary="Выборочное профилирование маршрута",
+    description="Профилировать каждый N-й запрос маршрута, например route=GET /books/{book_id}. "
+                "every=0 выключает выборку для маршрута.",
+    dependencies=[Depends(profiler.require_token)],
+    )
+async def set_profiler_sampling(request: Request, route: str, every: int = Query(ge=0)):
+    """Задает правило выборки для маршрута."""
+    known = {
+        f"{method} {app_route.path}"
+        for app_route in request.app.routes
+        for method in getattr(app_route, "methods", None) or ()
+    }
+    if route not in known:
+        raise HTTPException(404, "Маршрут не найден")
+    profiler.set_sampling(route, every)
+    return {"sampling": profiler.sampling()}
+
+@router.delete(
+    "/profiler/profiles",
+    summary="Очистка буфера профилей",
+    dependencies=[Depends(profiler.require_token)],
+    )
+async def clear_profiles():
+    """Удаляет сохраненные профили."""
+    profiler.clear()
+    return {"message": "Профили удалены"}
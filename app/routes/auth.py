@@ -6,8 +6,9 @@
 
 from fastapi import APIRouter, HTTPException, status
 from sqlalchemy.future import select
-from sqlalchemy import func
+from sqlalchemy import delete, func, update
 
+from app import outbox, review_store, versions
 from app.database import SessionDep
 from app.models import UserModel
 from app.schemas import UserSchema, UserAddSchema, UserUpdateSchema
@@ -64,7 +65,9 @@ async def update_user(
 ):
     """олучаем id-юзера из модели по id-номеру."""
     result = await session.execute(
-        select(UserModel).where(UserModel.id == user_id)
+        select(UserModel)
+        .where(UserModel.id == user_id)
+        .where(UserModel.is_deleted.is_(False))
     )
     actual_user = result.scalar()
     # Если id-шник не верный, то выдает ошибку
@@ -103,18 +106,34 @@ async def update_user(
     summary="Удаление пользователя из базы данных",
     description="Внимание!!! При выполнении данного запроса - "
                 "происходит удаление данны хпользователя из базы данных "
-                "(выбираем юзера по id-номеру).",
-    )
-async def del_user(user_id: int, session: SessionDep):
-    """Получаем юзера из модели по id-номеру."""
-    result = await session.execute(
-        select(UserModel).where(UserModel.id == user_id)
+                "(выбираем юзера по id-номеру). "
+                "С параметром background=true пользователь сразу блокируется, "
+                "а его отзывы удаляются в фоне небольшими порциями.",
     )
-    user = result.scalar()
-    if not user:
+async def del_user(user_id: int, session: SessionDep, background: bool = False):
+    """Удаляем юзера по id-номеру. Отзывы удаляет база (ON DELETE CASCADE)."""
+    if background:
+        result = await session.execute(
+            update(UserModel)
+            .where(UserModel.id == user_id)
+            .where(UserModel.is_deleted.is_(False))
+            .values(is_deleted=True)
+        )
+        payload = {}
+    else:
+        # После удаления отзывы сотрет база - книги для пересчета рейтингов узнаем заранее
+        payload = {"book_ids": await review_store.reviewed_books(user_id)}
+        result = await session.execute(
+            delete(UserModel).where(UserModel.id == user_id)
+        )
+    if not result.rowcount:
         raise HTTPException(404, f"Пользователь с ID-номером {user_id} не найден")
-    await session.delete(user)
+    versions.add_tombstone(session, "user", user_id)
+    outbox.emit(session, "user.deleted", user_id=user_id, **payload)
     await session.commit()
+    if background:
+        return {"message": f"Пользователь с ID-номером {user_id} помечен на удаление, "
+                           "отзывы будут удалены в фоне"}
 
     return {"message": f"Данные пользователя с ID-номером {user_id} удалены"}
 
@@ -127,6 +146,7 @@ async def login(user_data: UserAddSchema, session: SessionDep):
     result = await session.execute(
         select(UserModel)
         .where(func.lower(UserModel.username) == user_data.username.lower())
+        .where(UserModel.is_deleted.is_(False))
     )
     user = result.scalar()
 
@@ -2,16 +2,37 @@
 Модуль роутов - по книгам.
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse
+from sqlalchemy import delete, update
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import noload
 
+from app import outbox, recommendations, review_store, snapshot, suggest, versions
 from app.database import SessionDep
-from app.models import BookModel, ReviewModel
-from app.schemas import BookAddSchema, BookSchema, BookUpdateSchema
+from app.models import BookModel
+from app.schemas import (
+    BookAddSchema, BookSchema, BookSuggestSchema, BookUpdateSchema, SimilarBookSchema
+)
 
 router = APIRouter(prefix="/books", tags=["Books"])
 
+
+async def _with_ratings(books, book_ids=None) -> list[BookSchema]:
+    """Книги со средним рейтингом (без отзывов удаляемых пользователей)."""
+    stats = await review_store.rating_stats(book_ids)
+    schemas = []
+    for book in books:
+        review_count, rating_sum = stats.get(book.id, (0, 0))
+        schemas.append(BookSchema(
+            id=book.id,
+            title=book.title,
+            author=book.author,
+            genre=book.genre,
+            avg_rating=rating_sum / review_count if review_count else 0.0,
+        ))
+    return schemas
+
 ############################
 #Добавление новых книг в базу данных
 ############################
@@ -30,6 +51,7 @@ async def add_book(data: BookAddSchema, session: SessionDep):
         select(BookModel)
         .where(BookModel.title == data.title)
         .where(BookModel.author == data.author)
+        .where(BookModel.is_deleted.is_(False))
     )
     if exist_book.scalar():
         raise HTTPException(
@@ -41,6 +63,8 @@ async def add_book(data: BookAddSchema, session: SessionDep):
     genre=data.genre
     )
     session.add(new_book)
+    await session.flush()
+    outbox.emit(session, "book.changed", book_id=new_book.id)
     await session.commit()
     return {"message": "Книга добавлена", "book_id": new_book.id}
 
@@ -55,13 +79,60 @@ async def add_book(data: BookAddSchema, session: SessionDep):
     )
 async def get_books(session: SessionDep):
     """Возвращает список всех книг с краткой информацией о рейтингах."""
+    # Рейтинги считает review_store: отзывы могут лежать в шардах,
+    # а отзывы удаляемых пользователей учитывать нельзя
     result = await session.execute(
         select(BookModel)
-        # .options(selectinload(BookModel.reviews))
-        .options(selectinload(BookModel.reviews).load_only(ReviewModel.rating))
+        .where(BookModel.is_deleted.is_(False))
+        .options(noload(BookModel.reviews))
+    )
+    return await _with_ratings(result.scalars().all())
+
+############################
+#Скачивание снимка всего каталога
+############################
+@router.get(
+    "/snapshot",
+    summary="Скачивание всего каталога одним файлом",
+    description="Сжатый (gzip) JSON со всеми книгами и их рейтингами. "
+                "Файл собирается в фоне после изменений каталога; "
+                "поддерживаются заголовки Range и If-None-Match.",
+    response_class=FileResponse,
+    # tags=["Книги (GET-запросы)"],
+    )
+async def get_books_snapshot(request: Request):
+    """Отдает готовый файл снимка без обращения к базе данных."""
+    current = snapshot.current_snapshot()
+    if not current:
+        raise HTTPException(503, "Снимок каталога еще не готов, повторите запрос позже")
+    headers = {"ETag": current.etag, "X-Snapshot-Version": str(current.version)}
+    if request.headers.get("if-none-match") == current.etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(
+        current.path,
+        media_type="application/gzip",
+        filename=current.path.name,
+        headers=headers,
     )
-    books = result.scalars().all()
-    return books
+
+############################
+#Подсказки для строки поиска
+############################
+@router.get(
+    "/suggest",
+    response_model=list[BookSuggestSchema],
+    summary="Подсказки по началу названия или автора книги",
+    description="Книги, у которых название, автор или одно из их слов начинается "
+                "с введенного текста (без учета регистра). Сначала книги с большим "
+                "количеством отзывов и более высоким рейтингом.",
+    # tags=["Книги (GET-запросы)"],
+    )
+async def suggest_books(
+    prefix: str = Query(min_length=1, max_length=100),
+    limit: int = Query(suggest.SUGGEST_LIMIT, ge=1, le=suggest.SUGGEST_LIMIT),
+):
+    """Подсказки из префиксного индекса в памяти, без обращения к базе."""
+    return suggest.get_index().suggest(prefix, limit)
 
 ############################
 #Получение конретной книги, включая средний рейтинг
@@ -78,12 +149,35 @@ async def get_book(book_id: int, session: SessionDep):
     result = await session.execute(
         select(BookModel)
         .where(BookModel.id == book_id)
-        .options(selectinload(BookModel.reviews))
+        .where(BookModel.is_deleted.is_(False))
+        .options(noload(BookModel.reviews))
     )
     book = result.scalar()
     if not book:
         raise HTTPException(404, "Книга не найдена")
-    return book
+    return (await _with_ratings([book], [book_id]))[0]
+
+############################
+#Похожие книги ("Читатели также оценили")
+############################
+@router.get(
+    "/{book_id}/similar",
+    response_model=list[SimilarBookSchema],
+    summary="Похожие книги",
+    description="Книги, которые высоко оценили читатели этой книги. "
+                "Список пересчитывается в фоне после новых отзывов.",
+    # tags=["Книги (GET-запросы)"],
+    )
+async def get_similar_books(book_id: int, session: SessionDep):
+    """Готовые рекомендации из памяти; из базы только проверка, что книга есть."""
+    result = await session.execute(
+        select(BookModel.id)
+        .where(BookModel.id == book_id)
+        .where(BookModel.is_deleted.is_(False))
+    )
+    if result.scalar() is None:
+        raise HTTPException(404, "Книга не найдена")
+    return recommendations.similar_books(book_id)
 
 ############################
 #редактирование данных книги из базы данных
@@ -103,7 +197,9 @@ async def update_book(
 ):
     """Обновляем информацию о книге по её ID."""
     result = await session.execute(
-        select(BookModel).where(BookModel.id == book_id)
+        select(BookModel)
+        .where(BookModel.id == book_id)
+        .where(BookModel.is_deleted.is_(False))
     )
     book = result.scalar()
     #ID-шника нет в базе - получаем 404.
@@ -114,6 +210,7 @@ async def update_book(
         session_existing = await session.execute(
             select(BookModel)
             .where(BookModel.title == (data.title or book.title))
+            .where(BookModel.is_deleted.is_(False))
             # .where(BookModel.author == (data.author or book.author))
             # .where(BookModel.id != book_id)
         )
@@ -126,9 +223,10 @@ async def update_book(
     for key, value in update_data.items():
         setattr(book, key, value)
 
+    outbox.emit(session, "book.changed", book_id=book_id)
     await session.commit()
     await session.refresh(book)
-    return book
+    return (await _with_ratings([book], [book_id]))[0]
 
 ############################
 #Удаление книги из базы данных
@@ -138,18 +236,31 @@ async def update_book(
     "",
     summary="Удаление книги из базы данных",
     description="Внимание!!! При выполнении данного запроса - "
-                "происходит удаление книги из базы данных (выбираем книгу по id-номеру).",
+                "происходит удаление книги из базы данных (выбираем книгу по id-номеру). "
+                "С параметром background=true книга сразу скрывается, "
+                "а её отзывы удаляются в фоне небольшими порциями.",
     # tags=["Книги (DELETE-запросы)"],
     )
-async def del_book(book_id: int, session: SessionDep):
-    """Удаляем книгу по указанному ID. Если книгу нашли - удаляем"""
-    result = await session.execute(
-        select(BookModel).where(BookModel.id == book_id)
-    )
-    book = result.scalar()
+async def del_book(book_id: int, session: SessionDep, background: bool = False):
+    """Удаляем книгу по указанному ID. Отзывы удаляет база (ON DELETE CASCADE)."""
+    if background:
+        result = await session.execute(
+            update(BookModel)
+            .where(BookModel.id == book_id)
+            .where(BookModel.is_deleted.is_(False))
+            .values(is_deleted=True)
+        )
+    else:
+        result = await session.execute(
+            delete(BookModel).where(BookModel.id == book_id)
+        )
     #книги нет в базе - получаем 404.
-    if not book:
+    if not result.rowcount:
         raise HTTPException(404, "Книга не найдена")
-    await session.delete(book)
+    versions.add_tombstone(session, "book", book_id)
+    outbox.emit(session, "book.changed", book_id=book_id)
     await session.commit()
+    if background:
+        return {"message": f"Книга с ID-номером {book_id} помечена на удаление, "
+                           "отзывы будут удалены в фоне"}
     return {"message": f"Книга с ID-номером {book_id} удалена"}
@@ -4,10 +4,10 @@
 
 from fastapi import APIRouter, HTTPException
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
 
+from app import review_store
 from app.database import SessionDep
-from app.models import BookModel, ReviewModel
+from app.models import BookModel, ReviewModel, UserModel
 from app.schemas import ReviewAddSchema, ReviewSchema
 
 # router = APIRouter(prefix="/reviews", tags=["Отзывы на книги"])
@@ -33,15 +33,26 @@ async def add_review(data: ReviewAddSchema, session: SessionDep):
         user_id=data.user_id
         )
     result = await session.execute(
-        select(BookModel).where(BookModel.id == data.book_id)
+        select(BookModel)
+        .where(BookModel.id == data.book_id)
+        .where(BookModel.is_deleted.is_(False))
     )
     book = result.scalar()
 
     if not book:
         raise HTTPException(404, "Книга не найдена")
 
-    session.add(new_review)
-    await session.commit()
+    # Проверяем сами: в шардах внешних ключей нет, а в основной базе
+    # нарушение ключа закончилось бы ошибкой 500
+    result = await session.execute(
+        select(UserModel.id)
+        .where(UserModel.id == data.user_id)
+        .where(UserModel.is_deleted.is_(False))
+    )
+    if result.scalar() is None:
+        raise HTTPException(404, "Пользователь не найден")
+
+    await review_store.add_review(session, new_review)
     return {"message": "Отзыв добавлен"}
 
 
@@ -56,12 +67,6 @@ async def add_review(data: ReviewAddSchema, session: SessionDep):
     # tags=["Книги (GET-запросы)"]
     )
 async def get_reviews(session: SessionDep):
-    """Возвращает список всех отзывов."""
-    result = await session.execute(
-        select(ReviewModel)
-        .options(
-            selectinload(ReviewModel.book),
-            selectinload(ReviewModel.user))
-        )
-    reviews = result.scalars().all()
+    """Возвращает список всех отзывов (из всех шардов, если они включены)."""
+    reviews = await review_store.list_reviews(session)
     return reviews
@@ -0,0 +1,73 @@
+"""
+Модуль роутов - синхронизация изменений каталога.
+"""
+
+from fastapi import APIRouter, Query
+from sqlalchemy.future import select
+from sqlalchemy.orm import noload
+
+from app import review_store, versions
+from app.database import SessionDep
+from app.models import BookModel, TombstoneModel
+from app.schemas import SyncSchema
+
+router = APIRouter(prefix="/sync", tags=["Sync"])
+
+# Максимальный размер одной порции изменений
+SYNC_LIMIT = 5000
+
+############################
+#Изменения каталога после указанной версии
+############################
+@router.get(
+    "",
+    response_model=SyncSchema,
+    summary="Изменения книг и отзывов после указанной версии",
+    description="Возвращает книги и отзывы, добавленные или измененные после версии since, "
+                "и удаленные записи. Удаление книги или пользователя означает, что "
+                "удалены и все их отзывы; удаление отзыва (review) приходит, когда "
+                "отзыв получил новый ID-номер при переносе в шарды. Полученную версию передать как since "
+                "в следующем запросе; пока has_more=true - запрашивать дальше.",
+    )
+async def get_changes(
+    session: SessionDep,
+    since: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=SYNC_LIMIT),
+):
+    """Изменения с версией в (since, committed_version], не больше limit."""
+    until = versions.committed_version()
+    # Из каждого источника берем limit + 1, чтобы понять, есть ли продолжение
+    books = (await session.execute(
+        select(BookModel)
+        .where(BookModel.version > since)
+        .where(BookModel.version <= until)
+        .where(BookModel.is_deleted.is_(False))
+        .options(noload(BookModel.reviews))
+        .order_by(BookModel.version)
+        .limit(limit + 1)
+    )).scalars().all()
+    tombstones = (await session.execute(
+        select(TombstoneModel)
+        .where(TombstoneModel.version > since)
+        .where(TombstoneModel.version <= until)
+        .order_by(TombstoneModel.version)
+        .limit(limit + 1)
+    )).scalars().all()
+    reviews = await review_store.changed_reviews(since, until, limit + 1)
+
+    changes = sorted(
+        [("books", book) for book in books]
+        + [("reviews", review) for review in reviews]
+        + [("deleted", tombstone) for tombstone in tombstones],
+        key=lambda change: change[1].version,
+    )
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    response = {"books": [], "reviews": [], "deleted": []}
+    for kind, row in changes:
+        response[kind].append(row)
+    return SyncSchema(
+        version=changes[-1][1].version if has_more else until,
+        has_more=has_more,
+        **response,
+    )
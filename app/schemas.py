@@ -103,6 +103,57 @@ class BookSchema(BookBaseSchema):
         populate_by_name=True
         )
 
+##############################
+#Схема - Книга в снимке каталога (наследуется от схемы - книга)
+# + количество отзывов.
+##############################
+
+class BookSnapshotSchema(BookSchema):
+    """Схема книги для выгрузки всего каталога."""
+    review_count: int = Field(
+        example=12,
+        alias="Количество отзывов"
+        )
+
+
+##############################
+#Схема - Подсказка при поиске книги.
+##############################
+
+class BookSuggestSchema(BaseModel):
+    """Схема подсказки: книга, подходящая под введенный префикс."""
+    id: int = Field(
+        example=1,
+        alias="ID-номер книги в базе",
+        )
+    title: str = Field(
+        example="Война и Мир",
+        alias="Название книги",
+        )
+    author: str = Field(
+        example="Толстой А.Н.",
+        alias="Автор книги",
+        )
+
+    model_config = ConfigDict(
+        from_attributes=True,
+        populate_by_name=True
+        )
+
+
+##############################
+#Схема - Похожая книга (наследуется от схемы подсказки)
+# + оценка сходства.
+##############################
+
+class SimilarBookSchema(BookSuggestSchema):
+    """Схема похожей книги ("Читатели также оценили")."""
+    score: float = Field(
+        example=0.42,
+        description="Сходство книг по оценкам читателей",
+        alias="Сходство"
+        )
+
 
 ##############################
 #Схема - Редактировать книгу
@@ -193,6 +244,58 @@ class ReviewSchema(ReviewAddSchema):
         populate_by_name=True
         )
 
+##############################
+#Схемы для синхронизации изменений (GET /sync).
+##############################
+
+class BookSyncSchema(BookBaseSchema):
+    """Схема измененной книги."""
+    id: int = Field(
+        example=1,
+        alias="ID-номер книги в базе",
+        )
+    version: int = Field(example=42, alias="Версия")
+
+    model_config = ConfigDict(
+        from_attributes=True,
+        populate_by_name=True
+        )
+
+class ReviewSyncSchema(ReviewAddSchema):
+    """Схема измененного отзыва."""
+    id: int = Field(alias="Id-номер рецензии")
+    version: int = Field(example=42, alias="Версия")
+
+    model_config = ConfigDict(
+        from_attributes=True,
+        populate_by_name=True
+        )
+
+class TombstoneSchema(BaseModel):
+    """Схема удаленной записи: книга (book), пользователь (user) или отзыв (review)."""
+    entity: str = Field(example="book", alias="Тип записи")
+    entity_id: int = Field(example=1, alias="ID-номер записи")
+    version: int = Field(example=42, alias="Версия")
+
+    model_config = ConfigDict(
+        from_attributes=True,
+        populate_by_name=True
+        )
+
+class SyncSchema(BaseModel):
+    """Схема ответа синхронизации: изменения после версии since."""
+    version: int = Field(
+        example=42,
+        description="Передать как since в следующем запросе",
+        alias="Версия"
+        )
+    has_more: bool = Field(alias="Есть еще изменения")
+    books: list[BookSyncSchema] = Field(alias="Книги")
+    reviews: list[ReviewSyncSchema] = Field(alias="Отзывы")
+    deleted: list[TombstoneSchema] = Field(alias="Удаленные")
+
+    model_config = ConfigDict(populate_by_name=True)
+
 ##############################
 #Схема - База для пользователя (по аналогии с книгой).
 ##############################
@@ -51,7 +51,11 @@ async def get_current_user(
             print("[AUTH] Токен не содержит идентификатора пользователя (sub)")
             raise credentials_exception
         # Поиск пользователя (регистронезависимый)
-        query = select(UserModel).where(func.lower(UserModel.username) == username.lower())
+        query = (
+            select(UserModel)
+            .where(func.lower(UserModel.username) == username.lower())
+            .where(UserModel.is_deleted.is_(False))
+        )
         result = await session.execute(query)
         user = result.scalar()
 
@@ -0,0 +1,188 @@
+"""
+Модуль снимков каталога.
+
+Фоновая задача собирает все книги с агрегированным рейтингом в один
+сжатый JSON-файл на диске. Эндпоинт /books/snapshot отдает этот файл
+через FileResponse, поэтому скачивание каталога не требует запросов к базе.
+"""
+
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import review_store
+from app.database import new_session
+from app.models import BookModel
+from app.schemas import BookSnapshotSchema
+
+SNAPSHOT_DIR = Path(os.getenv("SNAPSHOT_DIR", "app/snapshots"))
+# Сколько секунд без изменений ждем перед пересборкой снимка
+SNAPSHOT_SETTLE_SECONDS = float(os.getenv("SNAPSHOT_SETTLE_SECONDS", "2"))
+# Дольше этого при непрерывной записи пересборку не откладываем
+SNAPSHOT_MAX_DELAY_SECONDS = float(os.getenv("SNAPSHOT_MAX_DELAY_SECONDS", "30"))
+# Сколько последних версий файла храним на диске
+SNAPSHOT_KEEP_VERSIONS = 2
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """Готовый снимок каталога на диске."""
+    version: int
+    path: Path
+    etag: str
+    # Хэш списка книг: по нему видно, что каталог не изменился
+    content_hash: str
+
+
+_current: Snapshot | None = None
+_dirty = asyncio.Event()
+
+
+def current_snapshot() -> Snapshot | None:
+    """Возвращает последний собранный снимок (или None, если его еще нет)."""
+    return _current
+
+
+def mark_dirty():
+    """Сообщает фоновой задаче, что каталог изменился."""
+    _dirty.set()
+
+
+def _snapshot_path(version: int) -> Path:
+    return SNAPSHOT_DIR / f"catalog-v{version}.json.gz"
+
+
+def _version_of(path: Path) -> int:
+    return int(path.name.removeprefix("catalog-v").removesuffix(".json.gz"))
+
+
+def _last_version_on_disk() -> int:
+    """Номер последней версии снимка, оставшейся с прошлого запуска."""
+    return max((_version_of(path) for path in SNAPSHOT_DIR.glob("catalog-v*.json.gz")), default=0)
+
+
+def _etag(data: bytes) -> str:
+    """ETag файла снимка: хэш сжатых байтов, как они лежат на диске."""
+    return f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+
+
+def _content_hash(payload: bytes) -> str:
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _body(version: int, payload: bytes) -> bytes:
+    return b'{"version":%d,"books":' % version + payload + b"}"
+
+
+def load_snapshot_from_disk() -> Snapshot | None:
+    """Последний снимок, оставшийся с прошлого запуска (None, если его нет)."""
+    version = _last_version_on_disk()
+    if not version:
+        return None
+    path = _snapshot_path(version)
+    data = path.read_bytes()
+    prefix = _body(version, b"")[:-1]
+    body = gzip.decompress(data)
+    if not body.startswith(prefix):
+        return None
+    return Snapshot(
+        version=version,
+        path=path,
+        etag=_etag(data),
+        content_hash=_content_hash(body[len(prefix):-1]),
+    )
+
+
+async def _load_books() -> list[dict]:
+    """Все книги с количеством отзывов и средним рейтингом."""
+    async with new_session() as session:
+        result = await session.execute(
+            select(BookModel.id, BookModel.title, BookModel.author, BookModel.genre)
+            .where(BookModel.is_deleted.is_(False))
+            .order_by(BookModel.id)
+        )
+    stats = await review_store.rating_stats()
+    books = []
+    for book_id, title, author, genre in result.all():
+        review_count, rating_sum = stats.get(book_id, (0, 0))
+        books.append(BookSnapshotSchema(
+            id=book_id,
+            title=title,
+            author=author,
+            genre=genre,
+            review_count=review_count,
+            avg_rating=rating_sum / review_count if review_count else 0.0,
+        ).model_dump(mode="json", by_alias=True))
+    return books
+
+
+def _write_snapshot(books: list[dict], previous: Snapshot | None) -> Snapshot | None:
+    """Сериализует и сжимает каталог. Возвращает None, если данные не изменились."""
+    payload = json.dumps(books, ensure_ascii=False, separators=(",", ":")).encode()
+    content_hash = _content_hash(payload)
+    if previous and previous.content_hash == content_hash:
+        return None
+
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    version = max(previous.version if previous else 0, _last_version_on_disk()) + 1
+    # mtime=0 - одинаковый каталог всегда дает одинаковые байты
+    data = gzip.compress(_body(version, payload), mtime=0)
+    path = _snapshot_path(version)
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+    # Старые версии удаляем: уже начатые скачивания дочитают открытый файл
+    for old_path in SNAPSHOT_DIR.glob("catalog-v*.json.gz"):
+        if _version_of(old_path) <= version - SNAPSHOT_KEEP_VERSIONS:
+            old_path.unlink(missing_ok=True)
+    # ETag считаем по байтам файла: в нем есть номер версии, и разные
+    # файлы не должны получить один ETag (иначе Range + If-Range склеит их)
+    return Snapshot(version=version, path=path, etag=_etag(data), content_hash=content_hash)
+
+
+async def rebuild_snapshot():
+    """Пересобирает снимок каталога, если данные изменились."""
+    global _current  # pylint: disable=global-statement
+    books = await _load_books()
+    snapshot = await asyncio.to_thread(_write_snapshot, books, _current)
+    if snapshot:
+        _current = snapshot
+        print(f"[SNAPSHOT] Каталог сохранен: версия {snapshot.version}, книг {len(books)}")
+
+
+async def run_snapshot_worker():
+    """Фоновая задача: собирает снимок при старте и после каждой серии изменений."""
+    global _current  # pylint: disable=global-statement
+    # До первой пересборки отдаем файл, оставшийся с прошлого запуска
+    try:
+        _current = await asyncio.to_thread(load_snapshot_from_disk)
+    except (OSError, ValueError) as e:
+        print(f"[SNAPSHOT] Снимок с диска не загружен: {str(e)}")
+    _dirty.set()
+    while True:
+        await _dirty.wait()
+        # Ждем, пока поток изменений утихнет, чтобы не пересобирать на каждую запись,
+        # но не дольше SNAPSHOT_MAX_DELAY_SECONDS - иначе снимок отстанет навсегда
+        deadline = time.monotonic() + SNAPSHOT_MAX_DELAY_SECONDS
+        while True:
+            _dirty.clear()
+            timeout = min(SNAPSHOT_SETTLE_SECONDS, deadline - time.monotonic())
+            if timeout <= 0:
+                break
+            try:
+                await asyncio.wait_for(_dirty.wait(), timeout)
+            except TimeoutError:
+                break
+        try:
+            await rebuild_snapshot()
+        except (SQLAlchemyError, OSError) as e:
+            print(f"[SNAPSHOT] Ошибка сборки снимка: {str(e)}")
@@ -0,0 +1,232 @@
+"""
+Префиксный индекс для подсказок поиска по названию и автору книги.
+
+Индекс - префиксное дерево в памяти. Ключи - название и автор книги, а также
+каждое их слово, приведенные к нижнему регистру (кириллица и латиница, ё = е).
+В каждом узле хранится готовый топ книг по количеству отзывов и рейтингу,
+поэтому подсказка стоит O(длины префикса) и не зависит от размера каталога.
+
+Изменения индекса (updating) и его пересборка (load_index) идут под одной
+блокировкой: иначе изменение, внесенное в старый индекс во время пересборки,
+пропало бы при замене индекса новым.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+from sqlalchemy import select
+
+from app import review_store
+from app.database import new_session
+from app.models import BookModel
+
+# Сколько подсказок храним в каждом узле (максимум для одного запроса)
+SUGGEST_LIMIT = 10
+# Глубина дерева; более длинные префиксы дофильтровываются по листу
+SUGGEST_MAX_DEPTH = 20
+
+
+def fold(text: str) -> str:
+    """Нормализация для поиска: регистр, ё/е и лишние пробелы."""
+    return " ".join(text.casefold().replace("ё", "е").split())
+
+
+@dataclass
+class SuggestEntry:
+    """Книга в индексе подсказок."""
+    id: int
+    title: str
+    author: str
+    review_count: int = 0
+    rating_sum: int = 0
+
+    @property
+    def avg_rating(self) -> float:
+        """Средний рейтинг книги."""
+        return self.rating_sum / self.review_count if self.review_count else 0.0
+
+
+class _Node:  # pylint: disable=too-few-public-methods
+    __slots__ = ("children", "book_ids", "top")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        # Книги, ключ которых заканчивается в этом узле
+        self.book_ids: set[int] | None = None
+        # Лучшие книги во всем поддереве, по убыванию ранга
+        self.top: list[int] = []
+
+
+class PrefixIndex:
+    """Префиксное дерево с топом книг в каждом узле."""
+
+    def __init__(self):
+        self._root = _Node()
+        self._books: dict[int, SuggestEntry] = {}
+        self._keys: dict[int, set[str]] = {}
+
+    def __len__(self):
+        return len(self._books)
+
+    def _rank(self, book_id: int):
+        book = self._books[book_id]
+        return -book.review_count, -book.avg_rating, book.id
+
+    def _best(self, book_ids) -> list[int]:
+        return sorted(set(book_ids), key=self._rank)[:SUGGEST_LIMIT]
+
+    @staticmethod
+    def _book_keys(title: str, author: str) -> set[str]:
+        """Ключи книги: с начала названия/автора и с начала каждого слова."""
+        keys = set()
+        for text in (fold(title), fold(author)):
+            words = text.split(" ")
+            for i in range(len(words)):
+                keys.add(" ".join(words[i:])[:SUGGEST_MAX_DEPTH])
+        keys.discard("")
+        return keys
+
+    def _insert_key(self, key: str, book_id: int):
+        node = self._root
+        path = [node]
+        for char in key:
+            node = node.children.setdefault(char, _Node())
+            path.append(node)
+        if node.book_ids is None:
+            node.book_ids = set()
+        node.book_ids.add(book_id)
+        for node in path:
+            if book_id not in node.top:
+                node.top = self._best(node.top + [book_id])
+
+    def _remove_key(self, key: str, book_id: int):
+        node = self._root
+        path = [node]
+        for char in key:
+            node = node.children[char]
+            path.append(node)
+        node.book_ids.discard(book_id)
+        # Снизу вверх: топ узла собирается из его книг и топов детей
+        for depth in range(len(path) - 1, -1, -1):
+            node = path[depth]
+            if depth < len(key):
+                child = path[depth + 1]
+                if not child.children and not child.book_ids:
+                    del node.children[key[depth]]
+            if book_id in node.top:
+                candidates = list(node.book_ids or ())
+                for child in node.children.values():
+                    candidates.extend(child.top)
+                node.top = self._best(candidates)
+
+    def load(self, entries):
+        """Заполняет индекс готовыми записями книг."""
+        for entry in entries:
+            self._books[entry.id] = entry
+            self._add_keys(entry.id)
+
+    def upsert(self, book_id: int, title: str, author: str):
+        """Добавляет книгу или обновляет её название/автора."""
+        self._remove_keys(book_id)
+        entry = self._books.get(book_id)
+        if entry:
+            entry.title, entry.author = title, author
+        else:
+            self._books[book_id] = SuggestEntry(book_id, title, author)
+        self._add_keys(book_id)
+
+    def remove(self, book_id: int):
+        """Убирает книгу из индекса."""
+        self._remove_keys(book_id)
+        self._books.pop(book_id, None)
+
+    def set_rating(self, book_id: int, review_count: int, rating_sum: int):
+        """Обновляет статистику отзывов книги (меняет её место в топах)."""
+        entry = self._books.get(book_id)
+        if not entry:
+            return
+        self._remove_keys(book_id)
+        entry.review_count, entry.rating_sum = review_count, rating_sum
+        self._add_keys(book_id)
+
+    def _add_keys(self, book_id: int):
+        book = self._books[book_id]
+        keys = self._book_keys(book.title, book.author)
+        for key in keys:
+            self._insert_key(key, book_id)
+        self._keys[book_id] = keys
+
+    def _remove_keys(self, book_id: int):
+        for key in self._keys.pop(book_id, ()):
+            self._remove_key(key, book_id)
+
+    def suggest(self, prefix: str, limit: int = SUGGEST_LIMIT) -> list[SuggestEntry]:
+        """Лучшие книги, название/автор (или их слово) которых начинается с префикса."""
+        prefix = fold(prefix)
+        node = self._root
+        for char in prefix[:SUGGEST_MAX_DEPTH]:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        if len(prefix) <= SUGGEST_MAX_DEPTH:
+            book_ids = node.top
+        else:
+            # Префикс длиннее дерева: сверяем полные строки книг из листа
+            book_ids = self._best(
+                book_id for book_id in node.book_ids or ()
+                if self._matches(book_id, prefix)
+            )
+        return [self._books[book_id] for book_id in book_ids[:limit]]
+
+    def _matches(self, book_id: int, prefix: str) -> bool:
+        book = self._books[book_id]
+        for text in (fold(book.title), fold(book.author)):
+            words = text.split(" ")
+            if any(" ".join(words[i:]).startswith(prefix) for i in range(len(words))):
+                return True
+        return False
+
+
+_index = PrefixIndex()
+_lock = asyncio.Lock()
+
+
+def get_index() -> PrefixIndex:
+    """Текущий индекс подсказок (только для чтения)."""
+    return _index
+
+
+@asynccontextmanager
+async def updating():
+    """Индекс для изменения. Данные для изменения читать внутри блока."""
+    async with _lock:
+        yield _index
+
+
+async def load_index():
+    """Строит индекс заново по данным из базы."""
+    global _index  # pylint: disable=global-statement
+    async with _lock:
+        async with new_session() as session:
+            result = await session.execute(
+                select(BookModel.id, BookModel.title, BookModel.author)
+                .where(BookModel.is_deleted.is_(False))
+            )
+        stats = await review_store.rating_stats()
+        index = PrefixIndex()
+        index.load(
+            SuggestEntry(book_id, title, author, *stats.get(book_id, (0, 0)))
+            for book_id, title, author in result.all()
+        )
+        _index = index
+
+
+async def refresh_ratings(book_ids: list[int]):
+    """Пересчитывает рейтинги только указанных книг, не перестраивая индекс."""
+    if not book_ids:
+        return
+    async with updating() as index:
+        stats = await review_store.rating_stats(book_ids)
+        for book_id in book_ids:
+            index.set_rating(book_id, *stats.get(book_id, (0, 0)))
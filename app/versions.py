@@ -0,0 +1,81 @@
+"""
+Версии изменений для инкрементальной синхронизации клиентов.
+
+Каждая вставка или изменение книги/отзыва и каждое удаление (запись в
+tombstones) получает номер версии из одного возрастающего счетчика процесса.
+Номер присваивается при flush сессии, поэтому работает и для шардов отзывов.
+
+Транзакции фиксируются не в порядке выдачи номеров, поэтому клиентам отдаются
+только изменения до committed_version(): все версии до нее уже в базе
+или откачены. Счетчик общий для процесса - приложение работает в одном процессе.
+"""
+
+from dataclasses import dataclass, field
+
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from app import review_store
+from app.database import new_session
+from app.models import BookModel, ReviewModel, TombstoneModel
+
+VERSIONED_MODELS = (BookModel, ReviewModel, TombstoneModel)
+
+
+@dataclass
+class VersionCounter:
+    """Счетчик версий процесса."""
+    last: int = 0
+    # Выданные, но еще не зафиксированные версии
+    in_flight: set[int] = field(default_factory=set)
+
+
+_counter = VersionCounter()
+
+
+def _allocate(session) -> int:
+    _counter.last += 1
+    _counter.in_flight.add(_counter.last)
+    session.info.setdefault("versions", []).append(_counter.last)
+    return _counter.last
+
+
+@event.listens_for(Session, "before_flush")
+def _stamp_versions(session, _flush_context, _instances):
+    """Новые и измененные строки получают следующую версию."""
+    for instance in session.new:
+        if isinstance(instance, VERSIONED_MODELS):
+            instance.version = _allocate(session)
+    for instance in session.dirty:
+        if isinstance(instance, VERSIONED_MODELS) \
+                and session.is_modified(instance, include_collections=False):
+            instance.version = _allocate(session)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _release_versions(session, transaction):
+    """Транзакция зафиксирована или откачена - её версии больше не в работе."""
+    if transaction.parent is None:
+        for version in session.info.pop("versions", ()):
+            _counter.in_flight.discard(version)
+
+
+def committed_version() -> int:
+    """Версия, до которой включительно все изменения уже видны в базе."""
+    if _counter.in_flight:
+        return min(_counter.in_flight) - 1
+    return _counter.last
+
+
+def add_tombstone(session, entity: str, entity_id: int):
+    """Записывает удаление книги/пользователя в текущую транзакцию."""
+    session.add(TombstoneModel(entity=entity, entity_id=entity_id))
+
+
+async def init_versions():
+    """Продолжает счетчик с максимальной версии, сохраненной в базах."""
+    async with new_session() as session:
+        for model in VERSIONED_MODELS:
+            stored = await session.scalar(select(func.max(model.version)))
+            _counter.last = max(_counter.last, stored or 0)
+    _counter.last = max(_counter.last, await review_store.max_version())